@@ -1,6 +1,7 @@
 import aws_cdk as cdk
 import json
-from dotmap import DotMap
+from functools import lru_cache
+from types import SimpleNamespace
 from constructs import Construct
 from aws_cdk.custom_resources import (
     AwsCustomResource,
@@ -16,21 +17,62 @@ from aws_cdk import (aws_lambda as lambda_,
                      aws_events as events,
                      aws_events_targets as targets,
                      aws_ssm as ssm,
-                     aws_secretsmanager as secretsmanager,
-                     aws_apigateway as apigateway,
-                     aws_codecommit as codecommit,
-                     aws_amplify_alpha as amplify,
-                     aws_route53 as route53,
-                     aws_certificatemanager as acm,
-                     triggers as triggers
+                     aws_secretsmanager as secretsmanager
                      )
 
+# Files in the resources directory that the Lambda functions never load.  Leaving them
+# out keeps the deployment zip down to the handler modules themselves.
+LAMBDA_ASSET_EXCLUDE = [
+    "**/__pycache__",
+    "**/*.pyc",
+    "tweet_query_cli.py"
+]
+
+# Both stacks load the same config file, so it is only read and parsed once per synth.
+# Every JSON object becomes a SimpleNamespace so settings are read as attributes, for
+# example config.SNSTopic.EmailSubscription
+@lru_cache(maxsize=None)
 def load_config(ConfigFile):
     with open(ConfigFile) as json_config_file:
-        config_dict = json.load(json_config_file)
-    config = DotMap(config_dict)
+        config = json.load(json_config_file, object_hook=lambda d: SimpleNamespace(**d))
     return config
 
+# Records a CloudWatch alarm whenever a function runs for as long as its timeout, which
+# means Lambda cut it off before it finished.  Used for every function in both stacks
+# so the alarms stay identical.
+def add_timeout_alarm(stack, construct_id, function, alarm_name):
+    if function.timeout:
+        cloudwatch.Alarm(stack, construct_id,
+            metric=function.metric_duration(statistic="Maximum"),
+            evaluation_periods=1,
+            datapoints_to_alarm=1,
+            threshold=function.timeout.to_milliseconds(),
+            treat_missing_data=cloudwatch.TreatMissingData.IGNORE,
+            alarm_name=alarm_name
+        )
+
+# The SNS topic is used to publish notifications when needed.  Both stacks create the
+# same topic and subscriptions in their own region, so they share this function.
+def build_notification_topic(stack, config):
+    topic = sns.Topic(stack, "SNSTopic",
+        topic_name="outage_notifier_topic",
+        display_name="Topic used for publishing outage notifications"
+        )
+
+    # Email subscription created for the topic (more people could be added here)
+    topic.add_subscription(
+        subscriptions.EmailSubscription(config.SNSTopic.EmailSubscription)
+        )
+
+    # SMS subscription for topic - requires originating Pinpoint phone number.  Pinpoint
+    # not available in Ohio so this is provisioned to us-west-2. By default, a new account
+    # is in Sandbox until it has been used and Support case opened to move out. When in the
+    # sandbox, we must verify phone numbers we're sending to
+    topic.add_subscription(
+        subscriptions.SmsSubscription(config.SNSTopic.SubscriptionPhonenumber)
+        )
+    return topic
+
 class HashtagCdkEastStack(cdk.Stack):
 
     def __init__(self, scope: Construct, construct_id: str, **kwargs) -> None:
@@ -38,66 +80,40 @@ class HashtagCdkEastStack(cdk.Stack):
 
         config = load_config('./config.json')
 
-        # Creating parameter in Systems Manager to store date last notification
-        # was sent.  Once notification is sent, don't want to spam.
-        param = ssm.StringParameter(self, "LastNotification",
-            parameter_name="/hashtag_query/last_notification",
-            string_value="0",
-            description="Used to track the time the last notificaiton was sent",
-            type=ssm.ParameterType.STRING,
-            tier=ssm.ParameterTier.STANDARD,
-            allowed_pattern=".*"
-            )
-        cdk.CfnOutput(self, "LastNotificationARN", value=param.parameter_arn)
-        cdk.CfnOutput(self, "LastNotificationName", value=param.parameter_name)
-
-        # The SNS topic is used to publish notificaitons when needed
-        topic = sns.Topic(self, "SNSTopic",
-            topic_name="outage_notifier_topic",
-            display_name="Topic used for publishing outage notifications"
-            )
-        cdk.CfnOutput(self, "SNSTopicARN", value=topic.topic_arn)
-        cdk.CfnOutput(self, "SNSTopicName", value=topic.topic_name)
-
-        # Email subscription created for the topic (more people could be added here)
-        topic.add_subscription(
-            subscriptions.EmailSubscription(config.SNSTopic.EmailSubscription)
-            )
-
-        # SMS subscription for topic - requires originating Pinpoint phone number.  Pinpoint
-        # not available in Ohio so this is provisioned to us-west-2. By default, a new account
-        # is in Sandbox until it has been used and Support case opened to move out. When in the
-        # sandbox, we must verify phone numbers we're sending to        
-        topic.add_subscription(
-            subscriptions.SmsSubscription(config.SNSTopic.SubscriptionPhonenumber)
-            )
+        topic = build_notification_topic(self, config)
 
         # Secret previously added to Secrets Manager to store Twitter API key. This will define
         # where to find the key and later access can be given
         secret = secretsmanager.Secret.from_secret_attributes(self, "TwitterAPISecret",
             secret_complete_arn=config.TwitterAPISecret.APIkeyARN
             )
-        cdk.CfnOutput(self, "TwitterAPISecretARN", value=secret.secret_arn)
-        cdk.CfnOutput(self, "TwitterAPISecretName", value=secret.secret_name)
  
         # The DynamoDB table is used to store twitter results.  We are only tracking tweet ID
         # and the timestamp it was created.  Since the purpose of the app is for real time 
         # notification, we only need a few hours or days of data.  This table is destroyed when
         # the stack is destroyed.  The data is automatcially regenerated within a few mins of 
-        # deployment.
+        # deployment.  Writes arrive in bursts every five minutes and the analyzers read in
+        # bursts too, so on-demand billing avoids throttling without any capacity to tune.
+        # Each tweet carries an expireAt epoch so DynamoDB deletes old tweets for us and the
+        # table stays about the size of the window the analyzer looks at.
         table = dynamodb.Table(self, "GlobalTable",
             removal_policy=cdk.RemovalPolicy.DESTROY,
             partition_key=dynamodb.Attribute(name="tweetID", type=dynamodb.AttributeType.STRING),
+            time_to_live_attribute="expireAt",
             replication_regions=['us-west-2'],
-            billing_mode=dynamodb.BillingMode.PROVISIONED
+            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST
             )
-        cdk.CfnOutput(self, "GlobalTableARN", value=table.table_arn)
-        cdk.CfnOutput(self, "GlobalTableName", value=table.table_name)
 
-        table.auto_scale_write_capacity(
-            min_capacity=1,
-            max_capacity=10
-        ).scale_on_utilization(target_utilization_percent=75)
+        # The analyzer only cares about tweets from the last few hours.  Rather than scanning
+        # the whole table, tweets are indexed by the UTC hour they were created in so the
+        # analyzer can query just the hours it needs.  Only keys are projected since the
+        # created_at sort key is all the analyzer reads.
+        table.add_global_secondary_index(
+            index_name="by-hour",
+            partition_key=dynamodb.Attribute(name="hourBucket", type=dynamodb.AttributeType.STRING),
+            sort_key=dynamodb.Attribute(name="created_at", type=dynamodb.AttributeType.NUMBER),
+            projection_type=dynamodb.ProjectionType.KEYS_ONLY
+            )
 
         # When running multiple CloudFormation stacks within the same region, you're able to 
         # share references across stacks using CloudFormation Outputs.  However, outputs 
@@ -112,76 +128,84 @@ class HashtagCdkEastStack(cdk.Stack):
             allowed_pattern=".*"
             )
 
-        # This Lambda function calls the Twitter API and pushes results to DyanmoDB
+        # Both Lambda functions are packaged from the same resources directory with the same
+        # excludes, so the asset is defined once here and shared by the two of them.
+        # The handlers are pure Python so the functions run on cheaper and faster Graviton.
+        code = lambda_.Code.from_asset("resources", exclude=LAMBDA_ASSET_EXCLUDE)
+
+        # This Lambda function calls the Twitter API and pushes results to DyanmoDB.  Config
+        # files written before MemorySize existed get 1769 MB, which is one full vCPU.
         query_function = lambda_.Function(self, "QueryFunction",
-            runtime=lambda_.Runtime.PYTHON_3_9,
-            code=lambda_.Code.from_asset("resources"),
+            runtime=lambda_.Runtime.PYTHON_3_12,
+            architecture=lambda_.Architecture.ARM_64,
+            code=code,
             handler="tweet_query.lambda_handler",
             timeout=cdk.Duration.seconds(int(config.query_function.TimeoutDuration)),
+            memory_size=int(getattr(config.query_function, "MemorySize", 1769)),
             environment=dict(TABLE=table.table_name,
                 KEY_ARN=secret.secret_arn,
                 SNSTOPIC=topic.topic_arn)
             )
-        cdk.CfnOutput(self, "QueryFunctionARN", value=query_function.function_arn)
-        cdk.CfnOutput(self, "QueryFunctionName", value=query_function.function_name)
 
-        # Setting up a trigger to start the function based on a cron schedule
-        rule = events.Rule(self, "QuerySchedule",
+        # At a five minute cadence Lambda often reclaims idle environments between runs so
+        # most invokes would be cold starts.  Publishing a version behind an alias with
+        # provisioned concurrency keeps an initialized environment ready for each tick.
+        # Config files written before ProvisionedConcurrency existed get one environment.
+        query_alias = lambda_.Alias(self, "QueryAlias",
+            alias_name="live",
+            version=query_function.current_version,
+            provisioned_concurrent_executions=int(getattr(config.query_function, "ProvisionedConcurrency", 1))
+            )
+
+        # Setting up a trigger to start the function based on a cron schedule.  The analyzer
+        # runs on the same schedule so it is added as a second target of this rule below.
+        # Neither handler looks at the scheduled event, so each target is sent an empty
+        # object rather than the full EventBridge event.
+        rule = events.Rule(self, "Schedule",
             schedule=events.Schedule.cron(minute="*/5")
             )
-        rule.add_target(targets.LambdaFunction(query_function))
+        rule.add_target(targets.LambdaFunction(query_alias,
+            event=events.RuleTargetInput.from_object({})
+            ))
 
         # If too many results are returned from Twitter, we'll time out.  We got what we
         # needed but we'll record a cloudwatch alarm so we know it happened.
-        if query_function.timeout:
-            cloudwatch.Alarm(self, "QueryAlarm",
-                metric=query_function.metric_duration(statistic="Maximum"),
-                evaluation_periods=1,
-                datapoints_to_alarm=1,
-                threshold=query_function.timeout.to_milliseconds(),
-                treat_missing_data=cloudwatch.TreatMissingData.IGNORE,
-                alarm_name="Query Function Timeout"
-            )
+        add_timeout_alarm(self, "QueryAlarm", query_function, "Query Function Timeout")
 
         # This Lambda function queries DynamoDB, counts the results in hourly bins and 
         # performs a standard deviation.  If standard deviation is off the charts, it calls
         # the SNS topic 
         analyzer_function = lambda_.Function(self, "AnalyzerFunction",
-            runtime=lambda_.Runtime.PYTHON_3_9,
-            code=lambda_.Code.from_asset("resources"),
+            runtime=lambda_.Runtime.PYTHON_3_12,
+            architecture=lambda_.Architecture.ARM_64,
+            code=code,
             handler="tweet_analyzer.lambda_handler",
             timeout=cdk.Duration.seconds(int(config.analyzer_function.TimeoutDuration)),
+            memory_size=int(getattr(config.analyzer_function, "MemorySize", 1769)),
             environment=dict(TABLE=table.table_name,
-                LASTSENT=param.parameter_name,
                 SNSTOPIC=topic.topic_arn)
             )
-        cdk.CfnOutput(self, "AnalyzerFunctionARN", value=analyzer_function.function_arn)
-        cdk.CfnOutput(self, "AnalyzerFunctionName", value=analyzer_function.function_name)
 
-        # Setting up a cron schedule to trigger the analyzer
-        rule = events.Rule(self, "AnalyzerSchedule",
-            schedule=events.Schedule.cron(minute="*/5")
+        # Keep an initialized analyzer ready for the cron schedule, same as the query function
+        analyzer_alias = lambda_.Alias(self, "AnalyzerAlias",
+            alias_name="live",
+            version=analyzer_function.current_version,
+            provisioned_concurrent_executions=int(getattr(config.analyzer_function, "ProvisionedConcurrency", 1))
             )
-        rule.add_target(targets.LambdaFunction(analyzer_function))
+
+        # The analyzer shares the query function's cron schedule, one rule with two targets
+        rule.add_target(targets.LambdaFunction(analyzer_alias,
+            event=events.RuleTargetInput.from_object({})
+            ))
 
         # Given the analyzer only queries from DynamoDB and performs a little math, it's
         # unlikely it will timeout but we'll track it just in case
-        if analyzer_function.timeout:
-            cloudwatch.Alarm(self, "AnalyzerAlarm",
-                metric=analyzer_function.metric_duration(statistic="Maximum"),
-                evaluation_periods=1,
-                datapoints_to_alarm=1,
-                threshold=analyzer_function.timeout.to_milliseconds(),
-                treat_missing_data=cloudwatch.TreatMissingData.IGNORE,
-                alarm_name="Analyzer Function Timeout"
-            )
+        add_timeout_alarm(self, "AnalyzerAlarm", analyzer_function, "Analyzer Function Timeout")
 
-        # Grant Analyzer Lambda function access to the parameter store, SNS topic 
-        # and DynamoDB
-        param.grant_read(analyzer_function)
-        param.grant_write(analyzer_function)
+        # Grant Analyzer Lambda function access to the SNS topic and DynamoDB.  It writes
+        # to the table to record when it last sent a notification.
         topic.grant_publish(analyzer_function)
-        table.grant_read_data(analyzer_function)
+        table.grant_read_write_data(analyzer_function)
 
         # Grant Query Lambda function access to Secrets Manager, SNS and Dynamodb
         table.grant_write_data(query_function)
@@ -193,6 +217,12 @@ class HashtagCdkEastStack(cdk.Stack):
         # #################################################
         # Everything below this is related to front end
         # #################################################
+
+        # Before enabling the front end, add these back to the aws_cdk imports at the top:
+        # aws_apigateway as apigateway, aws_codecommit as codecommit,
+        # aws_amplify_alpha as amplify, aws_route53 as route53 and
+        # aws_certificatemanager as acm.  The amplify module comes from the separate
+        # aws-cdk.aws-amplify-alpha package.
         
         # ## DYNAMODB
 
@@ -206,7 +236,7 @@ class HashtagCdkEastStack(cdk.Stack):
 
         # # Lambda function for API Gateway
         # frontend_function = lambda_.Function(self, "FrontendFunction",
-        #     runtime=lambda_.Runtime.PYTHON_3_9,
+        #     runtime=lambda_.Runtime.PYTHON_3_12,
         #     code=lambda_.Code.from_asset("resources"),
         #     handler="tweet_frontend.lambda_handler",
         #     timeout=cdk.Duration.seconds(int(config.frontend_function.TimeoutDuration)),
@@ -389,84 +419,52 @@ class HashtagCdkWestStack(cdk.Stack):
         ).getParameterValue()
 
         # Use the global table name to lookup the existing table.  We'll need this 
-        # reference later to add read permissions
-        table = dynamodb.Table.from_table_name(self, "GlobalTable", global_table_name)
-        cdk.CfnOutput(self, "TableARN", value=table.table_arn)
-        cdk.CfnOutput(self, "TableName", value=table.table_name)
-
-        # Creating parameter in Systems Manager to store date last notification
-        # was sent.  Once notification is sent, don't want to spam.
-        param = ssm.StringParameter(self, "LastNotification",
-            parameter_name="/hashtag_query/last_notification",
-            string_value="0",
-            description="Used to track the time the last notificaiton was sent",
-            type=ssm.ParameterType.STRING,
-            tier=ssm.ParameterTier.STANDARD,
-            allowed_pattern=".*"
+        # reference later to add read and write permissions, including on the hour index
+        # the analyzer queries
+        table = dynamodb.Table.from_table_attributes(self, "GlobalTable",
+            table_name=global_table_name,
+            global_indexes=["by-hour"]
             )
-        cdk.CfnOutput(self, "LastNotificationARN", value=param.parameter_arn)
-        cdk.CfnOutput(self, "LastNotificationName", value=param.parameter_name)
 
-        # The SNS topic is used to publish notificaitons when needed
-        topic = sns.Topic(self, "SNSTopic",
-            topic_name="outage_notifier_topic",
-            display_name="Topic used for publishing outage notifications"
-            )
-        cdk.CfnOutput(self, "TopicARN", value=topic.topic_arn)
-        cdk.CfnOutput(self, "TopicName", value=topic.topic_name)
-
-        # Email subscription created for the topic (more people could be added here)
-        topic.add_subscription(
-            subscriptions.EmailSubscription(config.SNSTopic.EmailSubscription)
-            )
-
-        # SMS subscription for topic - requires originating Pinpoint phone number.  Pinpoint
-        # not available in Ohio so this is provisioned to us-west-2. By default, a new account
-        # is in Sandbox until it has been used and Support case opened to move out. When in the
-        # sandbox, we must verify phone numbers we're sending to        
-        topic.add_subscription(
-            subscriptions.SmsSubscription(config.SNSTopic.SubscriptionPhonenumber)
-            )
+        topic = build_notification_topic(self, config)
 
         # This Lambda function queries DynamoDB, counts the results in hourly bins and 
         # performs a standard deviation.  If standard deviation is off the charts, it calls
         # the SNS topic 
         analyzer_function = lambda_.Function(self, "analyzer_function",
-            runtime=lambda_.Runtime.PYTHON_3_9,
-            code=lambda_.Code.from_asset("resources"),
+            runtime=lambda_.Runtime.PYTHON_3_12,
+            architecture=lambda_.Architecture.ARM_64,
+            code=lambda_.Code.from_asset("resources", exclude=LAMBDA_ASSET_EXCLUDE),
             handler="tweet_analyzer.lambda_handler",
             timeout=cdk.Duration.seconds(int(config.analyzer_function.TimeoutDuration)),
+            memory_size=int(getattr(config.analyzer_function, "MemorySize", 1769)),
             environment=dict(TABLE=global_table_name,
-                LASTSENT=param.parameter_name,
                 SNSTOPIC=topic.topic_arn)
             )
-        cdk.CfnOutput(self, "analyzer_functionARN", value=analyzer_function.function_arn)
-        cdk.CfnOutput(self, "analyzer_functionName", value=analyzer_function.function_name)
+
+        # Keep an initialized analyzer ready for the cron schedule so ticks avoid cold starts
+        analyzer_alias = lambda_.Alias(self, "analyzer_alias",
+            alias_name="live",
+            version=analyzer_function.current_version,
+            provisioned_concurrent_executions=int(getattr(config.analyzer_function, "ProvisionedConcurrency", 1))
+            )
 
         # Setting up a cron schedule to trigger the analyzer
         rule = events.Rule(self, "analyzer_schedule",
             schedule=events.Schedule.cron(minute="*/5")
             )
-        rule.add_target(targets.LambdaFunction(analyzer_function))
+        rule.add_target(targets.LambdaFunction(analyzer_alias,
+            event=events.RuleTargetInput.from_object({})
+            ))
 
         # Given the analyzer only queries from DynamoDB and performs a little math, it's
         # unlikely it will timeout but we'll track it just in case
-        if analyzer_function.timeout:
-            cloudwatch.Alarm(self, "analyzer_alarm",
-                metric=analyzer_function.metric_duration(statistic="Maximum"),
-                evaluation_periods=1,
-                datapoints_to_alarm=1,
-                threshold=analyzer_function.timeout.to_milliseconds(),
-                treat_missing_data=cloudwatch.TreatMissingData.IGNORE,
-                alarm_name="Analyzer Function Timeout"
-            )
+        add_timeout_alarm(self, "analyzer_alarm", analyzer_function, "Analyzer Function Timeout")
 
-        # Grant Analyzer Lambda function access to the parameter store, SNS topic 
-        # and DynamoDB
-        param.grant_read(analyzer_function)
-        param.grant_write(analyzer_function)
+        # Grant Analyzer Lambda function access to the SNS topic and DynamoDB.  It writes
+        # to the table to record when it last sent a notification.
         topic.grant_publish(analyzer_function)
-        table.grant_read_data(analyzer_function)
+        table.grant_read_write_data(analyzer_function)
 
 
 
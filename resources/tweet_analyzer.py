@@ -1,120 +1,152 @@
 import boto3
 import os
 import json
+import logging
 import time
-from datetime import datetime, timedelta
-from boto3.dynamodb.conditions import Key, Attr
-from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from botocore.config import Config
 import statistics
 
-# This fuction is used to take a list and count the number of times a number
-# shows up in-between a min and max.  Each Tweet has a create_at date.  Those
-# dates are converted to UNIX EPOCH time which makes it an integer representing
-# the number of seconds from Jan 1, 1970.  The end result is a series of bins
-# containing the count of tweets in each bin.
-def count_range_in_list(list, min, max):
-    counter=0
-    for item in list: 
-        if min <= item <= max: 
-            counter += 1
+# Log through the Lambda runtime's root logger.  Arguments are only formatted when the
+# message is actually written, so the debug messages cost nothing at INFO level.
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# The AWS clients are created once per container rather than on every invocation so
+# warm runs skip loading the service models and reuse already open HTTPS connections
+boto_config = Config(tcp_keepalive=True, max_pool_connections=10,
+                     retries={"max_attempts": 2, "mode": "adaptive"})
+sns = boto3.client('sns', config=boto_config)
+dynamodb = boto3.resource('dynamodb', config=boto_config)
+
+# Grab the DynamoDB table name from the Lambda's environment variable
+table = dynamodb.Table(os.environ['TABLE'])
+
+# Grab the SNS Topic name from the Lambda's environment variable
+sns_arn = os.environ['SNSTOPIC']
+
+# Key of the item in the tweet table that records when this region last sent a
+# notification.  It has no hourBucket so it never shows up in the by-hour index.
+LAST_SENT_KEY = "last_notification#" + os.environ['AWS_REGION']
+
+# Key condition for counting one hour partition of the by-hour index.  It is written out
+# once as an expression string rather than rebuilt from Key() conditions on every query.
+HOUR_KEY_CONDITION = "hourBucket = :bucket AND created_at BETWEEN :min AND :max"
+
+# Tweets are indexed by the UTC hour they were created in, formatted the same way the
+# query function writes them.  This returns the index partition for every hour touched
+# by the time frame.
+def hour_buckets(start_time, end_time):
+    first_hour = start_time - start_time % 3600
+    return [datetime.fromtimestamp(hour, timezone.utc).strftime("%Y-%m-%dT%H")
+            for hour in range(first_hour, end_time + 1, 3600)]
+
+# This fuction is used to count the number of tweets created in-between a min and max.
+# Each Tweet has a create_at date.  Those dates are converted to UNIX EPOCH time which
+# makes it an integer representing the number of seconds from Jan 1, 1970.  Each hour
+# is its own partition in the by-hour index so we only query the hours we need instead
+# of scanning the whole table.  Select='COUNT' has DynamoDB return just the number of
+# matching tweets rather than the tweets themselves.  A query returns at most 1 MB so
+# we keep following LastEvaluatedKey until the hour has been counted completely.
+# Eventually consistent reads cost half as much and a tweet arriving a second late
+# makes no difference to an hourly count.  The hours are counted from several threads
+# at once, so this goes through the resource's client rather than the Table object,
+# which is not safe to share between threads.  The key condition is a plain expression
+# string because boto3 builds Key() conditions with a single builder attached to that
+# client, and concurrent queries would reset each other's placeholders mid-build.
+def count_tweets(min, max):
+    counter = 0
+    for bucket in hour_buckets(min, max):
+        query = dict(
+            TableName=table.name,
+            IndexName="by-hour",
+            KeyConditionExpression=HOUR_KEY_CONDITION,
+            ExpressionAttributeValues={':bucket': bucket, ':min': min, ':max': max},
+            Select='COUNT',
+            ConsistentRead=False
+        )
+        while True:
+            response = dynamodb.meta.client.query(**query)
+            counter += response['Count']
+            if 'LastEvaluatedKey' not in response:
+                break
+            query['ExclusiveStartKey'] = response['LastEvaluatedKey']
     return counter
 	
 def lambda_handler(event, context):
-    sns = boto3.client('sns')
-    ssm = boto3.client('ssm')
-    dynamodb = boto3.resource('dynamodb')
-
     # This is the number of hours of data to query from DynamoDB.  We're looking for a 
     # huge spike in tweets so it's very much a real-time notification.
     HOURS_AGO = 6
 
-    # Grab the DynamoDB table name from the Lambda's environment variable
-    table = dynamodb.Table(os.environ['TABLE'])
-
-    # Grab the SNS Topic name from the Lambda's environment variable
-    sns_arn = os.environ['SNSTOPIC']
-    
-    end_time = int(datetime.timestamp(datetime.now()))
-    start_time = int(datetime.timestamp(datetime.now() - timedelta(hours=HOURS_AGO)))
-
-    # Query DynamoDB for records within a time frame
-    Fe = Key('created_at').between(start_time, end_time);
-    response = table.scan(
-                  FilterExpression=Fe
-              )
-    print("DynamoDB table query included",response['Count'], "items.")
-
-    # DynamoDB returns a list of dictionarys.  Each dictionary reprsents a Tweet 
-    # consisting of a Tweet ID and a create_at timestamp.  It's not easy working 
-    # with a list of dictionarys so this next line converts the object to a list
-    # of timestamps
-    mylist = [l['created_at'] for l in response['Items']]
-    print("List of dates included ", len(mylist), "items.")
-
-    distribution = []
-    min = start_time
-    print("Start time:", datetime.fromtimestamp(int(start_time)))
-    print("  End time:", datetime.fromtimestamp(int(end_time)))
-    
-    again = True
     i = 3600                # number of seconds in an hour
-    min = start_time
-    max = start_time + i
-
-    # We are stepping through this while loop in timed increments.  For exmaple,
-    # we count all tweets in the first hour, then again in the second hour and 
-    # so on.  When the loop is completed, we end up with a list of tweet counts
-    # over some distribution of time.  
-    while again:
-        # print("Counting tweets between", min, "and", max)
-        counter = count_range_in_list(mylist, min, max)
-        # print(counter)
-        distribution.append(counter)
-        min = max
-        max += i
-        if max > end_time: again = False
-    print("Distribution:",distribution)
+
+    # Read the clock once and work out every other time from it in whole seconds
+    now = int(time.time())
+    end_time = now
+    start_time = now - HOURS_AGO * i
+
+    five_hours_ago = now - 5 * i
+
+    # Once a notification has gone out there is nothing more to do until the five hour
+    # cooldown is over, so check that before counting any tweets.  During an outage this
+    # is the common case and the run ends after one small read.  The conditional update
+    # further down still guards the actual send.
+    response = table.get_item(Key={'tweetID': LAST_SENT_KEY}, ConsistentRead=False)
+    last_sent = int(response.get('Item', {}).get('last_sent', 0))
+    logger.debug("Last notification sent at: %d", last_sent)
+    if last_sent >= five_hours_ago:
+        logger.info("Too soon to send another, exiting.")
+        return None
+
+    logger.debug("Counting tweets between %d and %d", start_time, end_time)
+
+    # We are counting tweets in timed increments.  For exmaple, we count all tweets in
+    # the first hour, then again in the second hour and so on.  We end up with a list
+    # of tweet counts over some distribution of time.  Only whole hours are counted and
+    # each second belongs to exactly one hour so a tweet on the boundary is not counted
+    # twice.  Every hour is an independent set of queries, so they all run at the same
+    # time and the whole distribution takes about as long as counting a single hour.
+    hours = range(start_time, end_time - i + 1, i)
+    with ThreadPoolExecutor(max_workers=len(hours)) as executor:
+        distribution = list(executor.map(lambda min: count_tweets(min, min + i - 1), hours))
+    logger.info("Distribution: %s", distribution)
 
     # We use the distribution of tweets per period to calculate a standard deviation.
     stdev = statistics.stdev(distribution)
-    print("Standard Deviation: ", "{:.2f}".format(stdev))
+    logger.info("Standard Deviation: %.2f", stdev)
 
     # Under normal operating sitinations, the standard deviation for a particular
     # tweet can vary wildly.  In the case of outages, it usually falls between 0 and 30
     # but it can go higher.  In a real massive outage situation, it would probably jump
     # up over 500.
     if stdev < 100: 
-      print("Standard Deviation within boundaries. Exiting.")
+      logger.info("Standard Deviation within boundaries. Exiting.")
       return None
 
     # The function runs a recurring basis and once there is a spike, it could take hours
     # before it stablizes and the standard deviation drops again.  We don't want to 
     # spam our audience every couple minutes so we keep track of when we sent the last
-    # notification by storing the timestamp in the SSM Parameter Store.  The location
-    # of the variable is passed from the CDK deply to the Lambda's environment.
-    last_sent_parameter_name = os.environ['LASTSENT']
-    parameter = ssm.get_parameter(Name=last_sent_parameter_name, WithDecryption=True)
-    last_sent = int(parameter ['Parameter']['Value'])
-
-    five_hours_ago = int(datetime.timestamp(datetime.now() - timedelta(hours=5)))
-    now = int(datetime.now().timestamp())
-
-    print("Last notification sent at:", datetime.fromtimestamp(last_sent))
-    if last_sent > five_hours_ago:
-        print("Too soon to send another, exiting.")
+    # notification in an item of the tweet table.  The conditional update only records
+    # the current time if the last notification is older than five hours, so checking
+    # and updating is a single atomic call.  Each region keeps its own item so either
+    # region can still notify on its own when the other is having the outage.
+    logger.info("Updating last notification time with current send time")
+    try:
+        table.update_item(
+            Key={'tweetID': LAST_SENT_KEY},
+            UpdateExpression='SET last_sent = :now',
+            ConditionExpression='attribute_not_exists(last_sent) OR last_sent < :cutoff',
+            ExpressionAttributeValues={':now': now, ':cutoff': five_hours_ago}
+        )
+    except dynamodb.meta.client.exceptions.ConditionalCheckFailedException:
+        logger.info("Too soon to send another, exiting.")
         return None
 
-    print("Updating SSM Parameter with current send time")
-    result = ssm.put_parameter(
-        Name=last_sent_parameter_name,
-        Value=str(now),
-        Overwrite=True
-    )
-
     # Notfications are publish to the SNS topic and subscritions are added to the
     # topic.  This way we don't need to worry about how needs to be notified from
     # the Lambda function.
-    print("Attempting to publish to SNS topic: " + sns_arn)
+    logger.info("Attempting to publish to SNS topic: %s", sns_arn)
     message =  "Elevated levels of activity on Twitter."
     message += "Distribution over past 6 hours: " + str(distribution)
     message += "Standard Deviation: " + str(stdev)
@@ -1,105 +1,156 @@
 import boto3
+import calendar
 import os
 import datetime as dt
 import json
+import logging
 import urllib3
-import dateutil.parser as parser
+from botocore.config import Config
+from collections import OrderedDict
 from urllib.parse import urlencode
 
+# Log through the Lambda runtime's root logger.  The URL and next_token are only needed
+# when debugging, so a normal page costs a single log line.
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# The AWS clients are created once per container rather than on every invocation so
+# warm runs skip loading the service models and reuse already open HTTPS connections
+boto_config = Config(tcp_keepalive=True, max_pool_connections=10,
+                     retries={"max_attempts": 2, "mode": "adaptive"})
+secrets_client = boto3.client('secretsmanager', config=boto_config)
+dynamodb = boto3.resource('dynamodb', config=boto_config)
+sns = boto3.client('sns', config=boto_config)
+
+# Grab DynamoDB table name from Lambda environment variable
+table = dynamodb.Table(os.environ['TABLE'])
+
+# Tweet IDs this container has already written, oldest first.  Each run looks back a
+# whole hour, so most tweets come back again on the next few runs and skipping the ones
+# already stored saves their writes.  The oldest IDs are dropped past SEEN_LIMIT so a
+# long lived container does not keep growing.
+SEEN_LIMIT = 10000
+seen_tweets = OrderedDict()
+
+# One connection pool for the Twitter API so every page of results, and every warm
+# invocation, reuses the same keep-alive HTTPS connection instead of a new handshake
+http = urllib3.PoolManager()
+
+# Grab the SNS Topic name from the Lambda's environment variable
+sns_arn = os.environ['SNSTOPIC']
+
+# Grab Twitter API Header token from Secrets Manager ARN in Lambda environment variable.
+# The token does not change between runs, so it is fetched once per container and the
+# request headers are built once from it.  With provisioned concurrency this happens
+# while the environment is initialized, before any scheduled run arrives.
+secret_json = json.loads(secrets_client.get_secret_value(SecretId=os.environ['KEY_ARN']).get('SecretString'))
+# Twitter compresses the JSON when asked to and urllib3 decompresses it on read
+headers = {'Authorization': 'Bearer ' + secret_json['prod/hashtag_cdk/twitter_api'],
+           'Accept-Encoding': 'gzip, deflate'}
+
+# Twitter returns created_at in UTC as exactly YYYY-MM-DDTHH:MM:SS.000Z.  For that shape
+# the epoch is worked out straight from the digits and the hour bucket is simply the
+# first 13 characters, with no datetime object built at all.  Anything else falls back
+# to datetime.fromisoformat.  Returns the epoch and the hour bucket.
+def parse_created_at(created_at):
+    if len(created_at) == 24 and created_at[-1] == 'Z':
+        time = calendar.timegm((int(created_at[0:4]), int(created_at[5:7]), int(created_at[8:10]),
+                                int(created_at[11:13]), int(created_at[14:16]), int(created_at[17:19])))
+        return time, created_at[:13]
+    created = dt.datetime.fromisoformat(created_at).astimezone(dt.timezone.utc)
+    return int(created.timestamp()), created.strftime("%Y-%m-%dT%H")
+
 def lambda_handler(event, context):
-    secrets_client = boto3.client('secretsmanager')
-    dynamodb = boto3.resource('dynamodb')
-    sns = boto3.client('sns')
-    
     # Nunmber of hours back to query from Twitter API 
     QUERYTIME = 1
     # Hashtag to search for
     HASHTAG = "awsoutage"
     # Number of results to return, 100 max.  Need to use next_token to get more
     MAX_RESULTS = 100
+    # Number of hours a tweet is kept before DynamoDB expires it.  The analyzer only looks
+    # at the last 6 hours so anything older is just making the table bigger
+    RETENTION_HOURS = 24
 
     dtNow = dt.datetime.now(dt.timezone.utc) 
     start_time = (dtNow - dt.timedelta(hours=QUERYTIME)).isoformat()
 
-    # Grab the SNS Topic name from the Lambda's environment variable
-    sns_arn = os.environ['SNSTOPIC']
-
-    # Grab DynamoDB table name from Lambda environment variable
-    mytable = os.environ['TABLE']
-    table = dynamodb.Table(mytable)
-
     # print('## Environment Variables: ', os.environ)
     # print('## API Key ARN: ', os.environ['KEY_ARN'])
 
-    # Grab Twitter API Header token from Secrets Manager ARN in Lambda environment variable
-    secret_json = json.loads(secrets_client.get_secret_value(SecretId=os.environ['KEY_ARN']).get('SecretString'))
-    auth_token = secret_json['prod/hashtag_cdk/twitter_api']
-
-    next_token=""
-    again=True
-    while again:
-        url = "https://api.twitter.com/2/tweets/search/recent?"
-        querystring = {"query":HASHTAG,
+    # The search parameters are the same on every page so they are encoded once
+    search_url = "https://api.twitter.com/2/tweets/search/recent?" + urlencode(
+                    {"query":HASHTAG,
                     "max_results":MAX_RESULTS,
-                    "tweet.fields":"created_at",
-                    "user.fields":"created_at"
-                    }
-
-        # The first pass needs a start_time to lookup.  Each time we query the next 100
-        # results, we pass the next_token Twitter gave us instead of the start_time
-        if next_token:
-            querystring["next_token"] = next_token
-        else:
-            querystring["start_time"] = start_time
+                    "tweet.fields":"created_at"
+                    })
 
-        headers = {'Authorization': 'Bearer '+ auth_token}
-        http = urllib3.PoolManager()
-        url = url + urlencode(querystring)
-        print(url)
+    # The first pass needs a start_time to lookup.  Each time we query the next 100
+    # results, we pass the next_token Twitter gave us instead of the start_time
+    url = search_url + "&" + urlencode({"start_time": start_time})
+    while True:
+        logger.debug("Requesting %s", url)
 
         res = http.request(method='GET',
                         url=url,
                         headers=headers)
         if res.status != 200:
-            print("Exited with status: ", urllib3.exceptions.HTTPError(res.status))
-            print(res.data)
+            logger.error("Exited with status: %d %s", res.status, res.data)
             return
         tweets_data = json.loads(res.data)
         
         count = tweets_data['meta']['result_count']
         if count == 0:
-            print(tweets_data)
-            print("No results returned")
+            logger.info("No results returned: %s", tweets_data)
  
-            print("Attempting to publish to SNS topic: " + sns_arn)
+            logger.info("Attempting to publish to SNS topic: %s", sns_arn)
             message =  "Completed run of Tweet Query Lambda Handler with the following results"
-            message += str(tweets_data)
+            message += json.dumps(tweets_data)
             # response = sns.publish (
             # TargetArn = sns_arn,
             # Message = json.dumps({'default': message}), MessageStructure = 'json')
 
             return
         else:
-            print("Twitter API returned " + str(count) + " results.")
+            logger.info("Twitter API returned %d results.", count)
 
         # Since we know there were results returned, we now record them in DynamoDB.  It's
         # expected that we will query some of the same tweets each time we run the Lambda
-        # fucntion so we use the Tweet ID as the unique key so we only store it once.
-        for tweet in tweets_data["data"]:
-            id = tweet['id']
-            time = int(dt.datetime.timestamp(parser.parse(tweet['created_at'])))
-            # print('{%s: %d}' % (id, time))
-            
-            table.put_item(
-                Item={
-                    'tweetID': tweet['id'],
-                    'created_at': time
-                    }
-            )
+        # fucntion so we use the Tweet ID as the unique key so we only store it once.  The
+        # batch writer groups the puts into BatchWriteItem requests of up to 25 items so a
+        # full page of results is a handful of round trips rather than one per tweet.  A
+        # BatchWriteItem request is rejected if it holds the same key twice, so the writer
+        # is told to keep only the last put for any repeated tweet ID.  Tweets this
+        # container already wrote on an earlier run are skipped altogether.
+        written = []
+        with table.batch_writer(overwrite_by_pkeys=['tweetID']) as batch:
+            for tweet in tweets_data["data"]:
+                id = tweet['id']
+                if id in seen_tweets:
+                    continue
+                time, hour_bucket = parse_created_at(tweet['created_at'])
+                # print('{%s: %d}' % (id, time))
+
+                # hourBucket is the partition key of the by-hour index the analyzer queries
+                batch.put_item(
+                    Item={
+                        'tweetID': tweet['id'],
+                        'created_at': time,
+                        'hourBucket': hour_bucket,
+                        'expireAt': time + RETENTION_HOURS * 3600
+                        }
+                )
+                written.append(id)
+
+        # The batch writer has flushed by now, so the page is safely stored and its IDs
+        # can be remembered for the next run
+        for id in written:
+            seen_tweets[id] = None
+        while len(seen_tweets) > SEEN_LIMIT:
+            seen_tweets.popitem(last=False)
 
         # If we made it this far, there are are more results to go get so we grab the next_token
-        if "next_token" in tweets_data["meta"]:
-            next_token = tweets_data["meta"]["next_token"]
-            print(next_token)
-        else:
-            again = False
+        if "next_token" not in tweets_data["meta"]:
+            break
+        next_token = tweets_data["meta"]["next_token"]
+        logger.debug("Next token: %s", next_token)
+        url = search_url + "&" + urlencode({"next_token": next_token})
@@ -20,14 +20,16 @@ def main():
     dtNow = dt.datetime.now(dt.timezone.utc) 
     start_time = (dtNow - dt.timedelta(hours=QUERYTIME)).isoformat()
 
+    # One connection pool for every page so the HTTPS connection to Twitter is reused
+    http = urllib3.PoolManager()
+
     next_token=""
     again=True
     while again:
         url = "https://api.twitter.com/2/tweets/search/recent?"
         querystring = {"query":HASHTAG,
                     "max_results":MAX_RESULTS,
-                    "tweet.fields":"created_at",
-                    "user.fields":"created_at"
+                    "tweet.fields":"created_at"
                     }
 
         # The first pass needs a start_time to lookup.  Each time we query the next 100
@@ -37,8 +39,8 @@ def main():
         else:
             querystring["start_time"] = start_time
 
-        headers = {'Authorization': 'Bearer '+ auth_token}
-        http = urllib3.PoolManager()
+        headers = {'Authorization': 'Bearer '+ auth_token,
+                   'Accept-Encoding': 'gzip, deflate'}
         url = url + urlencode(querystring)
         print(url)
 